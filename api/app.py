@@ -1,21 +1,72 @@
 # api/index.py
 from http.client import responses
+import json
 import logging
 import os
+from datetime import date
+from collections import OrderedDict
+from functools import wraps
+import threading
 from flask_cors import CORS
-from flask import Flask, Response, json, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from numpy import generic, ndarray
+import orjson
 import sys
+from typing import Callable
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from core.withdrawal_simulation import WithdrawalSimulation
 from core.investment_calculator import InvestmentCalculator
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    使用orjson进行JSON序列化，直接输出bytes，避免Python层面的编码开销
+    orjson无法序列化超出64位范围的整数（例如收益率很高、期限很长时的最终余额），
+    这时退回到标准库json的实现
+    """
+
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+    @staticmethod
+    def default(o):
+        """标准库json不认识numpy类型，退回时转换为Python的list和数值"""
+        if isinstance(o, ndarray):
+            return o.tolist()
+        if isinstance(o, generic):
+            return o.item()
+        return DefaultJSONProvider.default(o)
+
+    def _encode(self, obj) -> bytes | str:
+        """
+        先用orjson序列化，失败时直接调用标准库json，不经过super().dumps，避免orjson再执行一次
+        退回时保持与orjson相同的输出：不排序键、不转义非ASCII字符、没有多余的空格
+        """
+        try:
+            return orjson.dumps(obj, default=self.default, option=self.option)
+        except orjson.JSONEncodeError:
+            return json.dumps(obj, default=self.default, sort_keys=False, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(self, obj, **kwargs) -> str:
+        body = self._encode(obj)
+        return body.decode() if isinstance(body, bytes) else body
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 # 配置日志
 logging.basicConfig(
-    level=logging.DEBUG,  # 设置日志级别
+    level=os.environ.get("LOG_LEVEL", "INFO"),  # 设置日志级别，默认INFO，调试时可通过环境变量LOG_LEVEL=DEBUG开启
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler()  # 输出到控制台
@@ -37,21 +88,98 @@ WITHDRAWAL_TYPE = {
 }
 
 
+@app.errorhandler(ValueError)
+def handle_value_error(e):
+    """参数不合法（例如投资期超过上限）时返回400和错误信息，而不是500"""
+    return jsonify({"message": str(e)}), 400
+
+
 @app.route("/api/test", methods=["GET"])
 def test_route():
     return jsonify({"message": "Test successful!"})
 
 
-@app.route("/api/final_balance", methods=["POST"])
-def get_final_balance():
-    json_data = request.get_json()
-    year_return = float(json_data.get("year_return", 0)) / 100  # 年收益率
-    monthly_reserve = float(json_data.get("monthly_reserve", 0))  # 每月投资额度
-    initial_investment = float(json_data.get("initial_investment", 0))
-    reserve_periods = int(json_data.get("reserve_periods", 0))
-    increment = float(json_data.get("increment", 0))
-    incre_period = int(json_data.get("incre_period", 0))
+def _parse(json_data: dict, default_periods: int = 1) -> tuple:
+    """一次性取出计算所需的参数，返回值可以直接作为缓存函数的参数"""
+    return (
+        float(json_data.get("year_return", 0)) / 100,  # 年收益率
+        float(json_data.get("monthly_reserve", 0)),  # 每月投资额度
+        float(json_data.get("initial_investment", 0)),
+        int(json_data.get("reserve_periods", default_periods)),
+        float(json_data.get("increment", 0)),
+        int(json_data.get("incre_period", 0)),
+    )
+
+
+# 结果缓存的条数上限，以及可以缓存的每月数据的最大行数（100年，含第0个月）
+# 响应的大小由客户端传入的期限决定，超长期限的结果照常返回但不缓存，避免任意请求让缓存长期占用大量内存
+_RESULT_CACHE_SIZE = 256
+_RESULT_CACHE_MAX_ROWS = 100 * 12 + 1
+# 缓存键中的浮点数取8位小数（年收益率已除以100，相当于百分比的6位小数），避免表示误差导致相同的输入无法命中缓存
+_RESULT_CACHE_KEY_DIGITS = 8
+
+
+def _cache_key(args: tuple) -> tuple:
+    """由参数生成缓存键，只有键中的浮点数取整，计算本身使用原始的参数"""
+    return tuple(round(arg, _RESULT_CACHE_KEY_DIGITS) if isinstance(arg, float) else arg for arg in args)
+
+
+def _cache_results(rows: Callable[[dict], int]):
+    """
+    与lru_cache相同的按参数缓存（LRU淘汰），但只缓存rows(结果)不超过_RESULT_CACHE_MAX_ROWS的结果
+    键由_cache_key生成，浮点数参数只相差表示误差的请求共用同一个结果
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            key = _cache_key(args)
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+            result = func(*args)
+            if rows(result) <= _RESULT_CACHE_MAX_ROWS:
+                with lock:
+                    cache[key] = result
+                    if len(cache) > _RESULT_CACHE_SIZE:
+                        cache.popitem(last=False)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def _current_month() -> str:
+    """当前年月，作为缓存键的一部分（图表日期从本月开始，跨月后缓存的结果不再适用）"""
+    return date.today().strftime("%Y-%m")
+
+
+def _chart_data(data) -> dict:
+    """将InvestmentResult整理为图表用的响应数据"""
+    return {
+        "final_balance": data.final_balance,
+        "total_principal": data.total_principal,
+        "total_return": data.total_return,
+        "monthly_data": data.monthly_data
+    }
 
+
+@_cache_results(lambda result: len(result["result"]["monthly_data"]["Date"]))
+def _final_balance_result(
+        year_return: float,
+        monthly_reserve: float,
+        initial_investment: float,
+        reserve_periods: int,
+        increment: float,
+        incre_period: int,
+        month: str
+) -> dict:
+    """计算定投的最终余额，参数完全相同的请求直接命中缓存。month只用作缓存键"""
     calc = InvestmentCalculator(
         y_return=year_return,  # 10% 年收益率
         horizon=reserve_periods,  # 5年投资期
@@ -63,31 +191,22 @@ def get_final_balance():
     )
 
     data = calc.automatic_investment()
-    result = {
-        "final_balance": data.final_balance,
-        "total_principal": data.total_principal,
-        "total_return": data.total_return,
-        "monthly_data": json.loads(data.monthly_data.to_json(orient="records"))
-    }
+    return {"result": _chart_data(data)}
 
-    response = jsonify({"result": result})
-    return response
-
-
-@app.route("/api/present_data", methods=["POST"])
-def get_back_to_present():
-    present_method = request.args.get("target")
-    logger.debug(f"=======present_method======{present_method}")
-    json_data = request.get_json()
-
-    year_return = float(json_data.get("year_return", 0)) / 100  # 年收益率
-    monthly_reserve = float(json_data.get("monthly_reserve", 0))  # 每月投资额度
-    initial_investment = float(json_data.get("initial_investment", 0))
-    reserve_periods = int(json_data.get("reserve_periods", 1))
-    increment = float(json_data.get("increment", 0))
-    incre_period = int(json_data.get("incre_period", 0))
-    target_amount = int(json_data.get("target_amount", 0))
 
+@_cache_results(lambda result: len(result["chart_data"]["monthly_data"]["Date"]))
+def _present_result(
+        present_method: str,
+        target_amount: float,
+        year_return: float,
+        monthly_reserve: float,
+        initial_investment: float,
+        reserve_periods: int,
+        increment: float,
+        incre_period: int,
+        month: str
+) -> dict:
+    """根据目标金额反推所需的值并计算图表数据，参数完全相同的请求直接命中缓存。month只用作缓存键"""
     calc = InvestmentCalculator(
         y_return=year_return,  # 10% 年收益率
         horizon=reserve_periods,  # 5年投资期
@@ -117,17 +236,27 @@ def get_back_to_present():
         # logger.debug(f"=======back_to_present==horizon===={back_to_present}")
         data = calc.automatic_investment(horizon=back_to_present)
 
-    result = {
-        "final_balance": data.final_balance,
-        "total_principal": data.total_principal,
-        "total_return": data.total_return,
-        "monthly_data": json.loads(data.monthly_data.to_json(orient="records"))
+    return {
+        "chart_data": _chart_data(data),
+        "back_to_present": back_to_present
     }
 
-    responese = jsonify({
-        "chart_data": result,
-        "back_to_present": back_to_present
-    })
+
+@app.route("/api/final_balance", methods=["POST"])
+def get_final_balance():
+    json_data = request.get_json(cache=False)  # 经由OrjsonProvider.loads解析，不缓存原始请求体
+    response = jsonify(_final_balance_result(*_parse(json_data, default_periods=0), _current_month()))
+    return response
+
+
+@app.route("/api/present_data", methods=["POST"])
+def get_back_to_present():
+    present_method = request.args.get("target")
+    logger.debug("=======present_method======%s", present_method)
+    json_data = request.get_json(cache=False)  # 经由OrjsonProvider.loads解析，不缓存原始请求体
+    target_amount = float(json_data.get("target_amount", 0))
+
+    responese = jsonify(_present_result(present_method, target_amount, *_parse(json_data), _current_month()))
 
     return responese
 
@@ -135,8 +264,8 @@ def get_back_to_present():
 @app.route("/api/withdrawal_data", methods=["POST"])
 def get_withdrawal_data():
     simulation_type = request.args.get("target")
-    json_data = request.get_json()
-    logger.info(f"json_data:{json_data}")
+    json_data = request.get_json(cache=False)  # 经由OrjsonProvider.loads解析，不缓存原始请求体
+    logger.info("json_data:%s", json_data)
     try:
         simulation = WithdrawalSimulation(annual_return=json_data.get("annual_return"))
         data = None
@@ -155,7 +284,7 @@ def get_withdrawal_data():
             "no_invest": data.no_invest,
             "initial_balance": data.initial_balance,
             "monthly_withdrawal": data.monthly_withdrawal,
-            "monthly_data": json.loads(data.monthly_balances.reset_index().to_json(orient="records"))
+            "monthly_data": data.monthly_balances.reset_index().to_dict(orient="records")
         }
         responese = jsonify(result)
     except Exception :
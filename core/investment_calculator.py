@@ -1,22 +1,58 @@
-from numpy import zeros, ndarray
-from numpy import round as np_round
+from numpy import (
+    arange,
+    cumsum,
+    datetime64,
+    divide,
+    empty,
+    exp,
+    expm1,
+    int64,
+    log1p,
+    minimum,
+    multiply,
+    ndarray,
+    power,
+    repeat,
+    rint,
+    subtract,
+)
 from dataclasses import dataclass
-from pandas import date_range, DataFrame, Timestamp
+from datetime import date
+from functools import lru_cache
 import math
 from typing import Literal
 
-# taku only
-# from matplotlib import pyplot as plt
+try:
+    from numba import njit
 
+    _HAS_NUMBA = True
+except ImportError:  # numba为可选依赖，未安装时只使用NumPy向量化的计算
+    _HAS_NUMBA = False
 
-@dataclass
+# 投资期（月数）不超过该值时使用numba编译的逐月循环，NumPy向量化在数组较短时调用开销占主导
+_JIT_MAX_MONTHS = 120
+# 投资期的上限（年）。每月数据按月数一次分配，必须有明确的上限，不能依赖内存分配失败
+_MAX_HORIZON = 100
+# 可以缓存月末日期的最大月数（100年）
+_DATES_CACHE_MAX_MONTHS = 100 * 12
+
+
+@dataclass(slots=True, frozen=True)
 class InvestmentResult:
     """investment result dataclass"""
 
     final_balance: float | int
     total_principal: float | int
     total_return: float | int
-    monthly_data: DataFrame
+    monthly_data: dict[str, tuple | ndarray]  # 按列存储的每月数据：Date, Principal, Return, Balance, Investment
+
+    def to_dataframe(self):
+        """转换为DataFrame，仅用于画图等本地分析；pandas在这里才导入，API的请求路径不会构建DataFrame"""
+        from pandas import DataFrame, to_datetime
+
+        frame = DataFrame(self.monthly_data)
+        frame["Date"] = to_datetime(frame["Date"])
+        return frame
 
 
 def _validate_inputs(params: dict) -> None:
@@ -25,6 +61,8 @@ def _validate_inputs(params: dict) -> None:
         raise ValueError("Yearly return rate cannot be less than 0")
     if params["horizon"] <= 0:
         raise ValueError("Investment horizon must be positive")
+    if params["horizon"] > _MAX_HORIZON:
+        raise ValueError(f"Investment horizon cannot exceed {_MAX_HORIZON} years")
     if params["m_investment"] < 0:
         raise ValueError("Monthly investment cannot be negative")
     if params["init_balance"] < 0:
@@ -37,6 +75,83 @@ def _validate_inputs(params: dict) -> None:
         raise ValueError("Increment period cannot be negative")
 
 
+def _build_month_end_dates(current_month: str, month_num: int) -> tuple[str, ...]:
+    """从current_month（YYYY-MM）开始连续month_num + 1个月的月末日期（YYYY-MM-DD）"""
+    month_ends = (datetime64(current_month, "M") + arange(1, month_num + 2)).astype("datetime64[D]") - 1
+    return tuple(month_ends.astype(str).tolist())
+
+
+_cached_month_end_dates = lru_cache(maxsize=128)(_build_month_end_dates)
+
+
+def _month_end_dates(current_month: str, month_num: int) -> tuple[str, ...]:
+    """
+    同_build_month_end_dates，同一个月内结果不会变化，所以按(年月, 月数)缓存，返回不可变的tuple以便在多次请求间共享
+    只缓存不超过_DATES_CACHE_MAX_MONTHS个月的结果，超长的投资期每次重新生成，避免任意的月数让缓存长期占用大量内存
+    """
+    if month_num > _DATES_CACHE_MAX_MONTHS:
+        return _build_month_end_dates(current_month, month_num)
+    return _cached_month_end_dates(current_month, month_num)
+
+
+def _build_payload(dates: tuple[str, ...], monthly: ndarray) -> dict[str, tuple | ndarray]:
+    """
+    将每月数据整理为按列存储的dict（SoA），API层可以直接序列化，不需要经过DataFrame
+    monthly的四行依次为余额、本金、投资收益、投资额，整块一次取整为int64数组
+    数值列保持为numpy数组，由orjson（OPT_SERIALIZE_NUMPY）直接序列化，不需要逐个转换为Python的int
+    """
+    balances, principals, returns, invest = rint(monthly).astype(int64, copy=False)
+    return {
+        "Date": dates,
+        "Principal": principals,
+        "Return": returns,
+        "Balance": balances,
+        "Investment": invest,
+    }
+
+
+def _fill_investment(
+    invest: ndarray,
+    init_balance: float,
+    m_invest: float,
+    increment: float,
+    incre_period: int,
+) -> None:
+    """
+    先按年计算月定投额再展开到每个月：第一年为m_invest，之后每年增加increment，最多增加incre_period次
+    invest[0]为初始余额，作为第0期的投入
+    """
+    month_num = invest.shape[0] - 1
+    per_year = m_invest + increment * minimum(arange(math.ceil(month_num / 12)), incre_period)
+    invest[0] = init_balance
+    invest[1:] = repeat(per_year, 12)[:month_num]
+
+
+def _simulate(monthly: ndarray, r: float) -> None:
+    """
+    根据monthly第4行的每月投资额逐月累加余额和本金，写入前两行
+    循环内没有分支，安装numba时会被编译为机器码
+    """
+    balances = monthly[0]
+    principals = monthly[1]
+    invest = monthly[3]
+    growth = 1.0 + r
+    bal = invest[0]
+    princ = invest[0]
+    balances[0] = bal
+    principals[0] = princ
+    for i in range(1, invest.shape[0]):
+        bal = bal * growth + invest[i]
+        princ += invest[i]
+        balances[i] = bal
+        principals[i] = princ
+
+
+if _HAS_NUMBA:
+    # 磁盘缓存中记录了模块名，直接运行本文件（__main__）时无法与作为core包导入时共用缓存，所以不启用
+    _simulate = njit(cache=__name__ != "__main__", fastmath=True)(_simulate)
+
+
 class InvestmentCalculator:
     """
     A class to calculate the investment return and investment plan.
@@ -143,6 +258,8 @@ class InvestmentCalculator:
             else self._calculate_monthly_return(annual_return=annual_rate)
         )  # 判断是否有传入年化收益率
         month_num = int(self.horizon * 12 if horizon is None else horizon * 12)
+        if month_num > _MAX_HORIZON * 12:  # 例如back_to_present反推出的投资期超过上限时
+            raise ValueError(f"Investment horizon cannot exceed {_MAX_HORIZON} years")
         current_monthly_investment = (
             self.m_investment if m_investment is None else m_investment
         )
@@ -150,51 +267,49 @@ class InvestmentCalculator:
 
         """initial data array"""
         """第一个元素为初始值，后续元素开始依次为投资一个月，两个月，三个月……时的月初时候的数值"""
-        balances = zeros(month_num + 1)  # 账户余额
-        principals = zeros(month_num + 1)  # 投入本金
-        returns = zeros(month_num + 1)  # 投资收益
-        investment_amount = zeros(month_num + 1)  # 投资额
-
-        """setting initial value"""
-        """初始余额设置为0的情况下，会默认为每月定投额"""
-        balances[0] = self.init_balance
-        principals[0] = self.init_balance
-        investment_amount[0] = self.init_balance
-
-        for i in range(month_num):
-            year_num = i // 12
-
-            # Apply increment to monthly investment or not
-            if (
-                i % 12 == 0
-                and self._increment != 0
-                and year_num <= self._increment_period
-                and year_num != 0
-            ):
-                current_monthly_investment += self._increment
-
-            balances[i + 1] = (
-                balances[i] * (1 + excepted_return) + current_monthly_investment
+        # 四个序列放在同一块连续内存中，每一行都是连续的数组
+        monthly = empty((4, month_num + 1))
+        balances, principals, returns, investment_amount = monthly  # 账户余额，投入本金，投资收益，投资额
+
+        if self._increment == 0 or self._increment_period == 0:
+            # 没有定投额的增加时（最常见的情况）直接使用通项公式，不需要逐月累加：
+            # balance[k] = init * (1 + r)^k + m * ((1 + r)^k - 1) / r
+            k = arange(month_num + 1)
+            investment_amount.fill(current_monthly_investment)
+            investment_amount[0] = self.init_balance
+            multiply(k, current_monthly_investment, out=principals)
+            principals += self.init_balance
+            if excepted_return == 0:
+                balances[:] = principals
+            else:
+                exponent = k * log1p(excepted_return)  # k * log(1 + r)
+                expm1(exponent, out=balances)  # (1 + r)^k - 1，r很小时也能保持精度
+                balances *= current_monthly_investment / excepted_return
+                balances += self.init_balance * exp(exponent)
+        else:
+            _fill_investment(
+                investment_amount,
+                self.init_balance,
+                current_monthly_investment,
+                self._increment,
+                self._increment_period,
             )
-            principals[i + 1] = principals[i] + current_monthly_investment
-            returns[i + 1] = balances[i + 1] - principals[i + 1]
-            investment_amount[i + 1] = current_monthly_investment
 
-        """Create monthly data"""
-        dates = date_range(
-            start=Timestamp.now().to_period("M").to_timestamp(),
-            periods=month_num + 1,
-            freq="ME",
-        )
+            if _HAS_NUMBA and month_num <= _JIT_MAX_MONTHS:
+                _simulate(monthly, float(excepted_return))
+            else:
+                # balance[k] = balance[k-1] * (1 + r) + invest[k] 的通项为
+                # balance[k] = (1 + r)^k * Σ_{j<=k} invest[j] / (1 + r)^j，用累加一次向量化算出
+                growth = power(1 + excepted_return, arange(month_num + 1))  # (1 + r)^k
+                divide(investment_amount, growth, out=balances)
+                cumsum(balances, out=balances)
+                balances *= growth
+                cumsum(investment_amount, out=principals)
+        subtract(balances, principals, out=returns)  # 收益只在最后整体计算一次
 
-        monthly_data = DataFrame(
-            {
-                "Date": dates,
-                "Principal": np_round(principals).astype(int),  # 直接转换为整数
-                "Return": np_round(returns).astype(int),
-                "Balance": np_round(balances).astype(int),
-                "Investment": np_round(investment_amount).astype(int),
-            }
+        """Create monthly data"""
+        monthly_data = _build_payload(
+            _month_end_dates(date.today().strftime("%Y-%m"), month_num), monthly
         )
 
         return InvestmentResult(
@@ -219,7 +334,7 @@ class InvestmentCalculator:
         Parameters:
             target (str): "num" for monthly investment or "rate" for required return
             or "horizon" for required investment horizon.
-            value_target (float): Target final balance.
+            target_value (float): Target final balance.
 
         Returns:
             float: Required monthly investment or monthly return rate
@@ -233,67 +348,58 @@ class InvestmentCalculator:
 
         month_num = self.horizon * 12
         initial_balance = self.init_balance if initial is None else initial
+        # 绑定为局部变量，避免在计算中反复访问实例属性
+        r = self.__monthly_return
+        m_investment = self.m_investment
 
         if target == "amount":
             # Calculate required monthly investment
             if target_value <= initial_balance:
                 return 0  # 已达到目标,无需投资
             # 等比数列求和
-            if self.__monthly_return == 0:
+            if r == 0:
                 # Special case for 0% return
                 amount = (target_value - initial_balance) / month_num
                 return math.ceil(amount)
             else:
-                numerator = target_value - initial_balance * pow(
-                    1 + self.__monthly_return, month_num
-                )
-                denominator = (
-                    pow(1 + self.__monthly_return, month_num) - 1
-                ) / self.__monthly_return
+                compound = pow(1 + r, month_num)  # 只计算一次复利系数
+                numerator = target_value - initial_balance * compound
+                denominator = (compound - 1) / r
                 amount = numerator / denominator
                 return math.ceil(amount)
 
         elif target == "rate":
             # Calculate required monthly return rate using numerical method
-            from scipy.optimize import fsolve
+            from scipy.optimize import brentq
 
             if (
-                initial_balance == 0 and self.m_investment == 0
+                initial_balance == 0 and m_investment == 0
             ):  # 检测投资额和初始资产不能同时为0
                 return 0
             if (
-                target_value <= initial_balance + self.m_investment * month_num
+                target_value <= initial_balance + m_investment * month_num
             ):  # 如果目标值小于初始值+总投资额，直接返回0
                 return 0
 
-            tolerance = 1e-6  # 设定精度，用于判断是否达到目标值
-            left, right = (
-                0,
-                10.0,
-            )  # 设定二分法的左右边界，因为要求预期收益率大于0，所以左边界为0（小于0时候没有投资的必要）
-
-            def calc_final_value(r):
-                if abs(r) < 1e-10:
-                    return initial_balance + self.m_investment * month_num
-                return (
-                    initial_balance * pow(1 + r, month_num)
-                    + self.m_investment * (pow(1 + r, month_num) - 1) / r
-                )
-
-            while right - left > tolerance:
-                mid = (left + right) / 2
-                final_value = calc_final_value(mid)
-
-                if (
-                    final_value - target_value < tolerance
-                ) and final_value >= target_value:
-                    return mid
-                elif final_value < target_value:
-                    left = mid
-                else:
-                    right = mid
-
-            monthly = (left + right) / 2
+            def calc_final_value(rate):
+                if abs(rate) < 1e-10:
+                    return initial_balance + m_investment * month_num
+                compound = (1.0 + rate) ** month_num
+                # 先算正幂再相除，收益率很小时也能保持精度
+                return initial_balance * compound + m_investment * (compound - 1.0) / rate
+
+            # 终值随收益率单调递增，且收益率为0时终值小于目标值，所以根在(0, right]之间
+            # 第一个月的投入至少会复利month_num - 1次，即终值 >= (初始值 + 月投资额) * (1 + r)^(month_num - 1)
+            # 由此解出的r一定不小于根，作为右边界比固定的大区间少很多次迭代
+            right = pow(
+                target_value / (initial_balance + m_investment), 1 / max(month_num - 1, 1)
+            ) - 1
+            while calc_final_value(right) < target_value:  # 投资期只有一个月时上面的估计不成立，逐步扩大
+                right *= 2
+
+            monthly = brentq(
+                lambda rate: calc_final_value(rate) - target_value, 0, right, xtol=1e-10
+            )
             annual = pow(1 + monthly, 12) - 1
 
             return max(annual, 0)
@@ -303,17 +409,13 @@ class InvestmentCalculator:
             if target_value <= initial_balance:  # 如果目标值小于初始值，直接返回0
                 return 0  # 已达到目标
             # Calculate number of months using the derived formula
-            if self.__monthly_return == 0:
+            if r == 0:
                 # Special case for 0% return
-                months = (target_value - initial_balance) / self.m_investment
+                months = (target_value - initial_balance) / m_investment
             else:
-                numerator = target_value + self.m_investment / self.__monthly_return
-                denominator = (
-                    initial_balance + self.m_investment / self.__monthly_return
-                )
-                months = math.log(numerator / denominator) / math.log(
-                    1 + self.__monthly_return
-                )
+                numerator = target_value + m_investment / r
+                denominator = initial_balance + m_investment / r
+                months = math.log(numerator / denominator) / math.log1p(r)
 
             # Convert months to years, ensure non-negative and ceiling to next integer
             years = math.ceil(max(0, months / 12))
@@ -342,9 +444,10 @@ if __name__ == "__main__":
         print(f"Total principal invested: {final_result.total_principal:.2f}")
         print(f"Total return: {final_result.total_return:.2f}")
 
-        # 画图
-        # final_result.monthly_data.plot(x="Date", y=["Principal", "Return", "Balance"])
+        # 画图（matplotlib只在这里导入，不影响API进程的启动时间）
         # taku only
+        # from matplotlib import pyplot as plt
+        # final_result.to_dataframe().plot(x="Date", y=["Principal", "Return", "Balance"])
         # plt.show()
 
         # 计算达到目标所需的每月投资额
@@ -1,10 +1,11 @@
 import math
 from dataclasses import dataclass
 from typing import Literal
+import numpy as np
 import pandas as pd
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class WithdrawalResult:
     """Withdrawal result dataclass"""
     years: float | int | tuple | None  # 用于返回可以持续的年数, tuple用于分别返回年数和月数, None表示永久持续
@@ -31,6 +32,18 @@ class WithdrawalSimulation:
         """Calculate the monthly return from the annual return. 使用的是几何平均数来计算月收益率"""
         return pow(1 + self.annual_return, 1 / 12) - 1
 
+    def _balance_path(self, initial_balance: float, monthly_withdrawal: float, months: int) -> np.ndarray:
+        """
+        由通项公式直接计算第1个月到第months个月每月提取后的余额，代替逐月循环。
+        balance[k] = initial_balance * (1 + r)^k - monthly_withdrawal * ((1 + r)^k - 1) / r
+        """
+        k = np.arange(1, months + 1)
+        r = self.monthly_return_rate
+        if r == 0:
+            return initial_balance - monthly_withdrawal * k
+        growth = np.power(1.0 + r, k)
+        return initial_balance * growth - monthly_withdrawal * (growth - 1.0) / r
+
     def simulate_years(self,
                        initial_balance: float,
                        monthly_withdrawal: float) -> WithdrawalResult:
@@ -47,8 +60,9 @@ class WithdrawalSimulation:
         if initial_balance <= 0 or monthly_withdrawal <= 0:
             raise ValueError("Initial balance and monthly withdrawal must be greater than 0.")
 
+        r = self.monthly_return_rate
         # 当月收益 >= 月提取额时，余额只增不减，会永远持续
-        if initial_balance * self.monthly_return_rate >= monthly_withdrawal:
+        if initial_balance * r >= monthly_withdrawal:
             no_invest = initial_balance / monthly_withdrawal
             empty_df = pd.DataFrame(columns=['Balance'])
             empty_df.index.name = 'Month'
@@ -60,16 +74,19 @@ class WithdrawalSimulation:
                 no_invest=(int(no_invest // 12), int(no_invest % 12))
             )
 
-        balance = initial_balance  # 初始的资产金额
-        months = 0  # 用于记录持续的月数
-        monthly_balances = []  # 用于记录每月的资产变化
+        # 余额大于每月取现金额时才会继续提取，由通项公式解出 balance[k] <= monthly_withdrawal 的最小k即为持续的月数
+        if r == 0:
+            estimate = math.ceil(initial_balance / monthly_withdrawal - 1)
+        else:
+            estimate = math.ceil(math.log(monthly_withdrawal * (1 - r) / (monthly_withdrawal - initial_balance * r))
+                                 / math.log1p(r))
+        estimate = max(estimate, 0)
 
-        while balance - monthly_withdrawal > 0:  # 当资产金额大于每月取现金额时，继续循环，来记录资产变化以及持续的月数
-            balance = balance * (1 + self.monthly_return_rate) - monthly_withdrawal
-            monthly_balances.append(balance)
-            months += 1
+        # 多算一个月的余额，用实际数值修正浮点误差带来的月数偏差
+        balances = self._balance_path(initial_balance, monthly_withdrawal, estimate + 1)
+        months = int(initial_balance > monthly_withdrawal) + int(np.count_nonzero(balances > monthly_withdrawal))
 
-        monthly_balances_df = pd.DataFrame(monthly_balances, columns=['Balance'])
+        monthly_balances_df = pd.DataFrame(balances[:months], columns=['Balance'])
         monthly_balances_df.index.name = 'Month'
 
         no_invest = initial_balance / monthly_withdrawal  # 这个方法中计算的不投资的情况下可以持续的月数
@@ -97,30 +114,17 @@ class WithdrawalSimulation:
         if initial_balance <= 0 or years <= 0:
             raise ValueError("Initial balance and years must be greater than 0.")
         months = int(years * 12)  # 将年数转换为月数
-        balance = initial_balance
-        monthly_balances = []
-
-        if self.monthly_return_rate == 0:
-            monthly_withdrawal = balance / months
-            for _ in range(months):
-                balance -= monthly_withdrawal
-                monthly_balances.append(balance)
-            monthly_balances_df = pd.DataFrame(monthly_balances, columns=['Balance'])
-            monthly_balances_df.index.name = 'Month'
-            return WithdrawalResult(years=years, monthly_withdrawal=monthly_withdrawal, initial_balance=initial_balance,
-                                    monthly_balances=monthly_balances_df)
-
-        numerator = balance * self.monthly_return_rate
-        denominator = (1 - pow(1 + self.monthly_return_rate, -months))
-        monthly_withdrawal = numerator / denominator
-
-        for _ in range(months):
-            if balance - monthly_withdrawal < 0:  # 当余额小于取现额的时候，停止循环
-                break
-            balance = balance * (1 + self.monthly_return_rate) - monthly_withdrawal
-            monthly_balances.append(balance)
-
-        monthly_balances_df = pd.DataFrame(monthly_balances, columns=['Balance'])
+        r = self.monthly_return_rate
+
+        if r == 0:
+            monthly_withdrawal = initial_balance / months
+        else:
+            numerator = initial_balance * r
+            denominator = (1 - pow(1 + r, -months))
+            monthly_withdrawal = numerator / denominator
+
+        monthly_balances_df = pd.DataFrame(self._balance_path(initial_balance, monthly_withdrawal, months),
+                                           columns=['Balance'])
         monthly_balances_df.index.name = 'Month'
 
         no_invest = initial_balance / months
@@ -144,29 +148,17 @@ class WithdrawalSimulation:
         if monthly_withdrawal <= 0 or years <= 0:
             raise ValueError("Monthly withdrawal and years must be greater than 0.")
         months = int(years * 12)
-        balance = 0
-        monthly_balances = []
+        r = self.monthly_return_rate
 
-        if self.monthly_return_rate == 0:
+        if r == 0:
             initial_balance = monthly_withdrawal * months
-            for _ in range(months):
-                balance -= monthly_withdrawal
-                monthly_balances.append(balance)
-            monthly_balances_df = pd.DataFrame(monthly_balances, columns=['Balance'])
-            monthly_balances_df.index.name = 'Month'
-            return WithdrawalResult(years=years, monthly_withdrawal=monthly_withdrawal, initial_balance=initial_balance,
-                                    monthly_balances=monthly_balances_df)
-
-        numerator = monthly_withdrawal * (1 - pow(1 + self.monthly_return_rate, -months))
-        denominator = self.monthly_return_rate
-        initial_balance = numerator / denominator
-        balance = initial_balance
-
-        for _ in range(months):
-            balance = balance * (1 + self.monthly_return_rate) - monthly_withdrawal
-            monthly_balances.append(balance)
-
-        monthly_balances_df = pd.DataFrame(monthly_balances, columns=['Balance'])
+        else:
+            numerator = monthly_withdrawal * (1 - pow(1 + r, -months))
+            denominator = r
+            initial_balance = numerator / denominator
+
+        monthly_balances_df = pd.DataFrame(self._balance_path(initial_balance, monthly_withdrawal, months),
+                                           columns=['Balance'])
         monthly_balances_df.index.name = 'Month'
 
         no_invest = months * monthly_withdrawal  # 这个方法中计算的不投资的情况下所需的初始金额
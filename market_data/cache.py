@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Callable, Hashable, Optional
+import pandas as pd
+
+
+class FileCache:
+    """
+    本地文件缓存
+    将DataFrame以pickle格式保存在cache_dir下，文件名为键的MD5值
+    每个缓存文件旁边有一个同名的JSON文件，记录写入时间，用于判断是否过期
+    """
+
+    def __init__(self, cache_dir: str = '.cache', ttl: Optional[float] = 86400):
+        """
+        参数:
+        cache_dir (str): 缓存目录
+        ttl (Optional[float]): 缓存有效期（秒），None表示永不过期
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _paths(self, key: Hashable) -> tuple:
+        """根据键计算缓存文件和记录写入时间的JSON文件的路径"""
+        digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, digest)
+        return base + '.pkl', base + '.json'
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """
+        读取缓存
+
+        返回:
+        Optional[pd.DataFrame]: 缓存的DataFrame，不存在、已过期或无法读取时返回None
+        """
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if self.ttl is not None and time.time() - meta['timestamp'] > self.ttl:
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        try:
+            return pd.read_pickle(data_path)
+        except Exception:
+            # 文件损坏或由不兼容的pandas版本写入时，unpickle可能抛出各种异常，一律视为未命中并删除，下次重新下载
+            self._remove(data_path, meta_path)
+            return None
+
+    def set(self, key: Hashable, df: pd.DataFrame):
+        """写入缓存，先写入临时文件再替换，写入中断时不会留下不完整的缓存文件"""
+        data_path, meta_path = self._paths(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._write_atomic(data_path, df.to_pickle)
+        self._write_atomic(
+            meta_path,
+            lambda path: self._dump_meta(path, {'key': repr(key), 'timestamp': time.time()})
+        )
+
+    def _write_atomic(self, path: str, write: Callable[[str], None]):
+        """调用write写入同目录下的临时文件，成功后用os.replace原子地替换为path"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _dump_meta(path: str, meta: dict):
+        """写入记录写入时间的JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @staticmethod
+    def _remove(*paths: str):
+        """删除文件，文件不存在时忽略"""
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -1,13 +1,39 @@
 from dataclasses import dataclass
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+import logging
+import math
+import multiprocessing as mp
 from typing import Dict, Optional, List, Tuple
+import warnings
 import yfinance as yf
 import pandas as pd
 import numpy as np
 
+try:
+    from .cache import FileCache
+except ImportError:  # 直接作为脚本运行时
+    from cache import FileCache
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+# 年化波动率按每年252个交易日折算
+_SQRT_TRADING_DAYS = math.sqrt(252)
+# 计算各项指标所需的最少收盘价个数：至少2个日收益率才能计算样本标准差（ddof=1）
+_MIN_PRICES = 3
+
+# generate_report(formatted=True)时各列的展示格式
+_FORMATS = {
+    '年化收益率': '{:.2%}',
+    '总收益率': '{:.2%}',
+    '年化波动率': '{:.2%}',
+    '最新价格': '{:.2f}',
+    '起始价格': '{:.2f}',
+    '分析起始日期': '{:%Y-%m-%d}',
+    '分析结束日期': '{:%Y-%m-%d}'
+}
+
+
+@dataclass(slots=True, frozen=True)
 class IndexReturn:
     """
     数据类，用于存储单个指数的分析结果
@@ -27,7 +53,7 @@ class IndexReturn:
     data_end_date: datetime  # 数据结束日期
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MarketAnalysis:
     """数据类，用于存储整体市场分析结果"""
     analysis_date: datetime  # 分析日期
@@ -42,7 +68,16 @@ class MarketIndexAnalyzer:
     需要修改指数的时候，只需要修改self.indices_dict即可。
     """
 
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[str] = '.cache'):
+        """
+        参数:
+        cache_dir (Optional[str]): 行情数据的本地缓存目录，None表示不使用缓存
+        """
+        # 行情数据的本地缓存，有效期为1天
+        self._file_cache = FileCache(cache_dir) if cache_dir else None
+        # 本进程内已完成的分析结果，键为(回溯年数, 分析日期, 指数配置)
+        self._cache: Dict[tuple, MarketAnalysis] = {}
+
         # 定义主要市场指数
         self.indices_dict = {
             'S&P 500': '^GSPC',
@@ -55,144 +90,284 @@ class MarketIndexAnalyzer:
         }
 
     @staticmethod
-    def _calculate_single_index_return(
-            self,
-            symbol: str,
-            name: str,
-            years: int = 10
-    ) -> Optional[IndexReturn]:
+    def _fetch_history(
+            symbols: List[str],
+            start_date: datetime,
+            end_date: datetime
+    ) -> pd.DataFrame:
         """
-        根据需要计算的指数代码和名称以及回溯年数
-        计算单个指数的回报指标
-
+        一次性批量下载所有指数的历史行情
+        yf.download会并发请求各个指数，返回的DataFrame列为(指数代码, 字段)的MultiIndex
 
         参数:
-        symbol (str): 指数代码
-        name (str): 指数名称
-        years (int): 回溯年数
+        symbols (List[str]): 指数代码列表
+        start_date (datetime): 起始日期
+        end_date (datetime): 结束日期
 
         返回:
-        Optional[IndexReturn]: 返回IndexReturn对象或None（如果获取数据失败）
+        pd.DataFrame: 按指数代码分组的历史行情
         """
-        try:
-            # 计算日期范围，使用 relativedelta 进行更精确的年份计算
-            end_date = datetime.now()
-            start_date = end_date - relativedelta(years=years)
-
-            # 获取数据
-            stock = yf.Ticker(symbol)
-            df = stock.history(start=start_date, end=end_date)
+        return yf.download(
+            tickers=' '.join(symbols),
+            start=start_date,
+            end=end_date,
+            group_by='ticker',
+            auto_adjust=True,  # 与Ticker.history的默认行为保持一致，使用复权后的收盘价
+            threads=True,
+            progress=False
+        )
 
-            if df.empty:
-                print(f"警告: {name} ({symbol}) 没有获取到数据")
-                return None
+    def _load_history(
+            self,
+            symbols: List[str],
+            start_date: datetime,
+            end_date: datetime
+    ) -> pd.DataFrame:
+        """
+        获取所有指数的历史行情，优先读取本地缓存
+        缓存的键只精确到日期，同一天内重复运行时直接使用缓存
+        """
+        if self._file_cache is None:
+            return self._fetch_history(symbols, start_date, end_date)
+
+        key = (tuple(symbols), start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        history = self._file_cache.get(key)
+        if history is None:
+            history = self._fetch_history(symbols, start_date, end_date)
+            # 只缓存所有指数都有数据的结果，部分指数下载失败时下次运行重新下载，不在有效期内一直使用不完整的数据
+            if self._is_complete(history, symbols):
+                try:
+                    self._file_cache.set(key, history)
+                except Exception as e:
+                    # 缓存只是加速手段，写入失败（目录不可写、磁盘已满等）时照常使用已下载的数据
+                    logger.warning("写入行情缓存失败: %s", e)
+        return history
 
-            # 计算各项指标
-            daily_returns = df['Close'].pct_change()  # 计算上下相邻的两项的百分比变化
-            total_return = (df['Close'].iloc[-1] / df['Close'].iloc[0]) - 1  # 计算最后一天相比于第一天的总收益率
+    @staticmethod
+    def _is_complete(history: pd.DataFrame, symbols: List[str]) -> bool:
+        """判断批量下载的结果中是否每个指数都有收盘价数据"""
+        columns = history.columns
+        return all(
+            (symbol, 'Close') in columns and history[(symbol, 'Close')].notna().any()
+            for symbol in symbols
+        )
 
-            # 计算年化收益率
-            trading_days = len(df)  # 获取交易日数
-            years_passed = trading_days / 252  # 假设每年有252个交易日
-            annual_return = (1 + total_return) ** (1 / years_passed) - 1  # 对总收益率进行开年次的根号，然后减1，计算年化收益率
+    @staticmethod
+    def _calculate_index_returns(
+            history: pd.DataFrame,
+            items: List[Tuple[str, str]],
+            years: int = 10
+    ) -> List[Optional[IndexReturn]]:
+        """
+        一次性计算所有指数的回报指标
+        将各指数的收盘价排成(交易日, 指数)的矩阵，按列向量化计算，
+        每个指数的结果与单独去掉NaN后计算一致，有效收盘价少于_MIN_PRICES个的指数返回None
 
-            # 计算年化波动率
-            annual_volatility = daily_returns.std() * np.sqrt(252)  # 由daily_returns.std计算出总年数的日波动率，然后乘以根号252，计算年化波动率
+        参数:
+        history (pd.DataFrame): 批量下载的历史行情，列为(指数代码, 字段)的MultiIndex
+        items (List[Tuple[str, str]]): (指数名称, 指数代码)的列表
+        years (int): 回溯年数
 
-            return IndexReturn(
+        返回:
+        List[Optional[IndexReturn]]: 与items一一对应的IndexReturn对象，没有数据或数据不足的指数为None
+        """
+        # items中有行情的指数在收盘价矩阵中对应的列
+        column_of = {}
+        for i, (_, symbol) in enumerate(items):
+            if symbol in history.columns:
+                column_of[i] = len(column_of)
+
+        counts = np.zeros(0, dtype=np.int64)
+        if column_of:
+            closes = history.xs('Close', axis=1, level=1)[[items[i][1] for i in column_of]]
+            dates = closes.index
+            prices = closes.to_numpy(dtype=np.float64)
+            # 各交易所的交易日不同，非交易日的收盘价为NaN；向前填充后相邻两行相除，
+            # 再去掉当天没有交易或之前还没有数据的位置，即为各指数去掉NaN后相邻交易日的收益率
+            filled = closes.ffill().to_numpy(dtype=np.float64)
+            valid = ~np.isnan(prices)
+            returns = filled[1:] / filled[:-1] - 1.0
+            returns[~valid[1:] | np.isnan(filled[:-1])] = np.nan
+
+            # 每列第一个和最后一个有数据的交易日
+            first = valid.argmax(axis=0)
+            last = prices.shape[0] - 1 - valid[::-1].argmax(axis=0)
+            columns = np.arange(prices.shape[1])
+            initial_prices = prices[first, columns]
+            latest_prices = prices[last, columns]
+            counts = valid.sum(axis=0)
+            start_dates = dates[first]
+            end_dates = dates[last]
+
+            # 数据不足的列也会一起计算，结果为inf或NaN，在下面统一跳过，这里不输出警告
+            with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # nanstd在有效值不足时的"Degrees of freedom <= 0"
+                total_returns = latest_prices / initial_prices - 1
+                # 按首尾日期之间的日历年数年化，各交易所每年的交易日数不同，不能统一按252天折算
+                years_passed = (end_dates - start_dates).total_seconds().to_numpy() / (365.25 * 86400)
+                # (1 + x)^(1/y) - 1 写成 expm1(log1p(x) / y)，收益率很小时精度更高
+                annual_returns = np.expm1(np.log1p(total_returns) / years_passed)
+                annual_volatilities = np.nanstd(returns, axis=0, ddof=1) * _SQRT_TRADING_DAYS
+
+        # 一次遍历items，按列取出各指数的结果
+        results = []
+        for i, (name, symbol) in enumerate(items):
+            j = column_of.get(i)
+            if j is None or counts[j] == 0:
+                logger.warning("%s (%s) 没有获取到数据", name, symbol)
+                results.append(None)
+                continue
+            if counts[j] < _MIN_PRICES:
+                logger.warning("%s (%s) 只有%d个交易日的数据，无法计算", name, symbol, counts[j])
+                results.append(None)
+                continue
+
+            traded = valid[:, j]
+            returned = ~np.isnan(returns[:, j])
+            results.append(IndexReturn(
                 symbol=symbol,
                 name=name,
-                annual_return=annual_return,
-                total_return=total_return,
-                annual_volatility=annual_volatility,
-                latest_price=df['Close'].iloc[-1],
-                initial_price=df['Close'].iloc[0],
-                daily_returns=daily_returns,
-                price_series=df['Close'],
+                annual_return=annual_returns[j],
+                total_return=total_returns[j],
+                annual_volatility=annual_volatilities[j],
+                latest_price=latest_prices[j],
+                initial_price=initial_prices[j],
+                daily_returns=pd.Series(returns[returned, j], index=dates[1:][returned], name='Close'),
+                price_series=pd.Series(prices[traded, j], index=dates[traded], name='Close'),
                 analysis_period=years,
-                data_start_date=df.index[0],
-                data_end_date=df.index[-1]
-            )
+                data_start_date=start_dates[j].to_pydatetime(),
+                data_end_date=end_dates[j].to_pydatetime()
+            ))
+        return results
 
-        except Exception as e:
-            print(f"错误: 处理 {name} ({symbol}) 时发生异常: {str(e)}")
-            return None
-
-    def analyze_market(self, years: int = 10) -> MarketAnalysis:
+    def analyze_market(self, years: int = 10, n_jobs: Optional[int] = None) -> MarketAnalysis:
         """
         分析所有配置的市场指数
         从class的indices_dict中获取指数代码和名称
-        然后使用_calculate_single_index_return方法计算每个指数的回报指标
+        然后使用_calculate_index_returns方法一次性计算所有指数的回报指标
         再利用_calculate_summary_stats方法计算汇总统计
         最后返回结果
 
         参数:
         years (int): 回溯年数
+        n_jobs (Optional[int]): 计算各指数时使用的进程数，大于1时把指数分为n_jobs组在进程池中计算，
+                                None或1时在本进程内对所有指数一次性计算，两者使用同一个实现
 
         返回:
         MarketAnalysis: 市场分析结果对象
         """
-        indices_results = {}
+        # 只读取一次当前时间，下载范围、缓存的键和分析日期都以此为准
+        end_date = datetime.now()
+
+        # 同一天内相同的回溯年数和指数配置直接返回之前的结果，修改indices_dict后键会随之变化
+        cache_key = (years, end_date.toordinal(), tuple(self.indices_dict.items()))
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # 计算日期范围，按日历年回溯，2月29日回溯到非闰年时取2月28日
+        try:
+            start_date = end_date.replace(year=end_date.year - years)
+        except ValueError:
+            start_date = end_date.replace(year=end_date.year - years, day=28)
+
+        items = list(self.indices_dict.items())
+        logger.info("分析 %s ...", ', '.join(f"{name} ({symbol})" for name, symbol in items))
 
-        # 分析每个指数
-        for name, symbol in self.indices_dict.items():
-            print(f"分析 {name} ({symbol})...")
-            result = self._calculate_single_index_return(symbol, name, years)  # result的类型是IndexReturn
-            if result:
-                indices_results[name] = result  # 将每个个股的分析结果保存在以个股名称命名的字典中
+        # 批量获取所有指数的数据
+        try:
+            history = self._load_history([symbol for _, symbol in items], start_date, end_date)
+        except Exception as e:
+            logger.error("下载指数数据时发生异常: %s", e)
+            history = pd.DataFrame()
+
+        if n_jobs is not None and n_jobs > 1:
+            # 指数很多时，把指数按顺序分为n_jobs组，每组只带上自己的行情，在子进程中各自批量计算
+            size = math.ceil(len(items) / n_jobs)
+            symbols = history.columns.get_level_values(0)
+            tasks = []
+            for start in range(0, len(items), size):
+                group = items[start:start + size]
+                tasks.append((history.loc[:, symbols.isin([symbol for _, symbol in group])], group, years))
+            with mp.Pool(n_jobs) as pool:
+                results = [result for group in pool.imap(_calculate_index_returns_task, tasks) for result in group]
+        else:
+            results = self._calculate_index_returns(history, items, years)
+
+        # 将每个个股的分析结果（IndexReturn）保存在以个股名称命名的字典中
+        indices_results = {name: result for (name, _), result in zip(items, results) if result}
 
         # 计算汇总统计
         summary_stats = self._calculate_summary_stats(indices_results)
 
         # 创建并返回市场分析结果
-        return MarketAnalysis(
-            analysis_date=datetime.now(),
+        analysis = MarketAnalysis(
+            analysis_date=end_date,
             indices=indices_results,
             summary_stats=summary_stats
         )
+        self._cache[cache_key] = analysis
+        return analysis
 
     @staticmethod
     def _calculate_summary_stats(
-            self,
             indices_results: Dict[str, IndexReturn]
     ) -> Dict[str, float]:
         """计算汇总统计指标"""
         """返回所有分析的指数的一个总结"""
-        returns = [index.annual_return for index in indices_results.values()]  # indices_results.values(
-        # )返回的是IndexReturn对象，获取每个IndexReturn对象的annual_return属性，组成一个列表
-        volatilities = [index.annual_volatility for index in indices_results.values()]
-        # 获取每个IndexReturn对象的annual_volatility属性，组成一个列表
+        # 一次性把每个指数的(年化收益率, 年化波动率)读入一个(n, 2)的数组，按列求均值、最大值和最小值
+        stats = np.fromiter(
+            (value for index in indices_results.values()
+             for value in (index.annual_return, index.annual_volatility)),
+            dtype=np.float64,
+            count=2 * len(indices_results)
+        ).reshape(-1, 2)
+        means, maxs, mins = stats.mean(0), stats.max(0), stats.min(0)
 
         return {
-            'average_annual_return': np.mean(returns),
-            'max_annual_return': np.max(returns),
-            'min_annual_return': np.min(returns),
-            'average_volatility': np.mean(volatilities),
-            'max_volatility': np.max(volatilities),
-            'min_volatility': np.min(volatilities)
+            'average_annual_return': means[0],
+            'max_annual_return': maxs[0],
+            'min_annual_return': mins[0],
+            'average_volatility': means[1],
+            'max_volatility': maxs[1],
+            'min_volatility': mins[1]
         }
 
     @staticmethod
-    def generate_report(self, analysis: MarketAnalysis) -> pd.DataFrame:
+    def generate_report(analysis: MarketAnalysis, formatted: bool = False) -> pd.DataFrame:
         """生成分析报告DataFrame"""
         """包括所需要分析的指数名称"""
         """将单个指数的分析结果进行汇总，转化为pd.DataFrame"""
         """可以根据单个的指数名称获取对应的分析结果"""
-        report_data = []
-
+        """默认保留数值，便于排序和后续计算；formatted为True时按_FORMATS转为用于展示的字符串"""
+        # 一次遍历按列收集原始数值
+        names, annual_returns, total_returns, annual_volatilities = [], [], [], []
+        latest_prices, initial_prices, start_dates, end_dates = [], [], [], []
         for name, index_return in analysis.indices.items():
-            report_data.append({
-                '指数名称': name,
-                '年化收益率': f'{index_return.annual_return:.2%}',
-                '总收益率': f'{index_return.total_return:.2%}',
-                '年化波动率': f'{index_return.annual_volatility:.2%}',
-                '最新价格': f'{index_return.latest_price:.2f}',
-                '起始价格': f'{index_return.initial_price:.2f}',
-                '分析起始日期': index_return.data_start_date.strftime('%Y-%m-%d'),
-                '分析结束日期': index_return.data_end_date.strftime('%Y-%m-%d')
-            })
-
-        return pd.DataFrame(report_data)
+            names.append(name)
+            annual_returns.append(index_return.annual_return)
+            total_returns.append(index_return.total_return)
+            annual_volatilities.append(index_return.annual_volatility)
+            latest_prices.append(index_return.latest_price)
+            initial_prices.append(index_return.initial_price)
+            start_dates.append(index_return.data_start_date)
+            end_dates.append(index_return.data_end_date)
+
+        report_df = pd.DataFrame({
+            '指数名称': names,
+            '年化收益率': np.asarray(annual_returns, dtype=np.float64),
+            '总收益率': np.asarray(total_returns, dtype=np.float64),
+            '年化波动率': np.asarray(annual_volatilities, dtype=np.float64),
+            '最新价格': np.asarray(latest_prices, dtype=np.float64),
+            '起始价格': np.asarray(initial_prices, dtype=np.float64),
+            '分析起始日期': pd.DatetimeIndex(start_dates),
+            '分析结束日期': pd.DatetimeIndex(end_dates)
+        })
+
+        if formatted:
+            for column, fmt in _FORMATS.items():
+                report_df[column] = report_df[column].map(fmt.format)
+        return report_df
 
     def save_results(
             self,
@@ -202,11 +377,22 @@ class MarketIndexAnalyzer:
         """保存分析结果到CSV文件"""
         """保存分析好的报告结果"""
         report_df = self.generate_report(analysis)
-        report_df.to_csv(filename, encoding='utf-8-sig', index=False)
-        print(f"\n分析结果已保存到 {filename}")
+        report_df.to_csv(filename, encoding='utf-8-sig', index=False, float_format='%.4f', date_format='%Y-%m-%d')
+        logger.info("分析结果已保存到 %s", filename)
+
+
+def _calculate_index_returns_task(task: tuple) -> List[Optional[IndexReturn]]:
+    """
+    进程池的工作函数，task为(这一组指数的行情, (指数名称, 指数代码)的列表, 回溯年数)
+    定义在模块顶层，才能被pickle后发送给子进程
+    """
+    return MarketIndexAnalyzer._calculate_index_returns(*task)
 
 
 def main():
+    # 分析进度和错误通过logging输出
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     # 使用示例
     analyzer = MarketIndexAnalyzer()
 
@@ -214,7 +400,7 @@ def main():
     analysis_result = analyzer.analyze_market(years=10)
 
     # 生成报告
-    report_df = analyzer.generate_report(analysis_result)
+    report_df = analyzer.generate_report(analysis_result, formatted=True)
     print("\n=== 分析报告 ===")
     print(report_df)
 